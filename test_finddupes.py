@@ -12,22 +12,24 @@ base_dir = './test'
 os.environ['DB_NAME'] = TEST_DB_NAME
 
 from finddupes import (
-    processed_data,
+    HEAD_HASH_BYTES,
+    MMAP_THRESHOLD,
     create_db_and_table,
     get_db_connection,
     close_db_connection,
     process_file,
     insert_data_batch,
     walk_directory,
-    load_existing_paths,
     rescan_duplicates,
     get_duplicates,
-    select_default_original,
+    select_original,
     list_duplicates_excluding_original,
     list_duplicates_csv,
     delete_duplicates,
     remove_missing_files,
     main,
+    _PARSER,
+    _run_process,
 )
 
 
@@ -53,9 +55,10 @@ def setup_environment():
     """
     os.environ['DB_NAME'] = TEST_DB_NAME
 
-    # Ensure the test database is clean
-    if os.path.exists(TEST_DB_NAME):
-        os.remove(TEST_DB_NAME)
+    # Ensure the test database (including WAL sidecar files) is clean
+    for db_file in (TEST_DB_NAME, TEST_DB_NAME + '-wal', TEST_DB_NAME + '-shm'):
+        if os.path.exists(db_file):
+            os.remove(db_file)
 
     # Remove any existing log files or output files
     if os.path.exists('duplicates.csv'):
@@ -63,15 +66,14 @@ def setup_environment():
     if os.path.exists('finddupes.log'):
         os.remove('finddupes.log')
 
-    processed_data.clear()
-
     yield
 
     # Teardown code
     if os.path.exists(base_dir):
         shutil.rmtree(base_dir)
-    if os.path.exists(TEST_DB_NAME):
-        os.remove(TEST_DB_NAME)
+    for db_file in (TEST_DB_NAME, TEST_DB_NAME + '-wal', TEST_DB_NAME + '-shm'):
+        if os.path.exists(db_file):
+            os.remove(db_file)
     if os.path.exists('duplicates.csv'):
         os.remove('duplicates.csv')
     if os.path.exists('finddupes.log'):
@@ -116,7 +118,7 @@ def test_process(setup_environment):
     expected_hashes = {}
     for file in files_to_create:
         file_path_abs = str(Path(file[0]).resolve())
-        file_hash = xxhash.xxh64(file[1]).hexdigest()
+        file_hash = xxhash.xxh3_64(file[1].encode()).hexdigest()
         expected_hashes[file_path_abs] = file_hash
 
     # Check that each file in the database matches the expected hash
@@ -441,3 +443,157 @@ def test_clean_db(setup_environment):
     result = cursor.fetchone()
     conn.close()
     assert result is None, "Missing file was not removed from the database."
+
+
+def test_same_head_different_tail_not_duplicates(setup_environment):
+    """
+    Test that the head-signature prefilter does not mistake two files that
+    share size and leading bytes but differ past HEAD_HASH_BYTES for
+    duplicates.
+    """
+    # Same size, identical first HEAD_HASH_BYTES, different tail
+    files_to_create = [
+        (base_dir + '/dir1/file1.txt', 'a' * HEAD_HASH_BYTES + 'b' * HEAD_HASH_BYTES),
+        (base_dir + '/dir2/file1.txt', 'a' * HEAD_HASH_BYTES + 'c' * HEAD_HASH_BYTES),
+    ]
+
+    setup_test_data(files_to_create)
+
+    main(base_dir, skip_existing=False, num_threads=2)
+
+    duplicates = list_duplicates_excluding_original()
+
+    # The files differ in content, so neither may be reported as a duplicate
+    assert len(duplicates) == 0, "Files with matching heads but different tails were reported as duplicates."
+
+
+def test_rescan_refreshes_stale_head_signature(setup_environment):
+    """
+    Test that rescan-duplicates does not leave a stale head signature
+    behind: after a duplicate's content changes and is rescanned, a new
+    byte-identical copy of the changed content must still be matched on
+    the next process run.
+    """
+    original = 'a' * HEAD_HASH_BYTES + 'tail'
+    changed = 'z' * HEAD_HASH_BYTES + 'tail'  # same size, different head
+    files_to_create = [
+        (base_dir + '/dir1/file1.txt', original),
+        (base_dir + '/dir2/file1.txt', original),
+    ]
+
+    setup_test_data(files_to_create)
+
+    main(base_dir, skip_existing=False, num_threads=2)
+
+    # Change one duplicate's content in place and rescan; the stored size
+    # and mtime now match the file, so only this rescan can fix the head
+    time.sleep(0.01)
+    with open(base_dir + '/dir2/file1.txt', 'w') as f:
+        f.write(changed)
+    rescan_duplicates()
+
+    # A new byte-identical copy of the changed content must collide with
+    # the rescanned file's head signature and be fully hashed
+    os.makedirs(base_dir + '/dir3', exist_ok=True)
+    with open(base_dir + '/dir3/file1.txt', 'w') as f:
+        f.write(changed)
+
+    main(base_dir, skip_existing=False, num_threads=2)
+
+    duplicates = list_duplicates_excluding_original(
+        preferred_source_directories=[str(Path(base_dir + '/dir2').resolve())]
+    )
+
+    assert str(Path(base_dir + '/dir3/file1.txt').resolve()) in duplicates, \
+        "New copy of the rescanned content was not matched as a duplicate."
+
+
+def test_duplicates_larger_than_mmap_threshold(setup_environment):
+    """
+    Test that identical files large enough to take the mmap hashing path
+    are still identified as duplicates.
+    """
+    content = 'x' * (MMAP_THRESHOLD + 1024)
+    files_to_create = [
+        (base_dir + '/dir1/big.bin', content),
+        (base_dir + '/dir2/big.bin', content),
+    ]
+
+    setup_test_data(files_to_create)
+
+    main(base_dir, skip_existing=False, num_threads=2)
+
+    duplicates = list_duplicates_excluding_original(
+        preferred_source_directories=[str(Path(base_dir + '/dir1').resolve())]
+    )
+
+    expected_duplicates = [
+        str(Path(base_dir + '/dir2/big.bin').resolve())
+    ]
+
+    assert all(file in duplicates for file in expected_duplicates), "Expected duplicates not found."
+    assert len(duplicates) == len(expected_duplicates), "Unexpected duplicates found."
+
+
+def test_skip_existing_directory_cache(setup_environment):
+    """
+    Test the --skip-existing directory quick-skip: a nested change doesn't
+    bump the top-level mtime so a second --skip-existing run skips the
+    walk, while a run without the flag picks the new file up.
+    """
+    files_to_create = [
+        (base_dir + '/dir1/file1.txt', '11111'),
+    ]
+
+    setup_test_data(files_to_create)
+
+    args = _PARSER.parse_args(['process', base_dir, '--skip-existing', '--threads', '2'])
+    _run_process(args)
+
+    # Add a file inside an existing subdirectory; the top-level mtime of
+    # base_dir does not change
+    with open(base_dir + '/dir1/file2.txt', 'w') as f:
+        f.write('22222')
+    new_path = str(Path(base_dir + '/dir1/file2.txt').resolve())
+
+    # Second --skip-existing run hits the cache and never sees the new file
+    _run_process(args)
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    cursor.execute('SELECT path FROM files WHERE path = ?', (new_path,))
+    assert cursor.fetchone() is None, "Quick-skip run should not have scanned the new file."
+
+    # A run without --skip-existing forces the full rescan
+    args = _PARSER.parse_args(['process', base_dir, '--threads', '2'])
+    _run_process(args)
+    cursor.execute('SELECT path FROM files WHERE path = ?', (new_path,))
+    result = cursor.fetchone()
+    conn.close()
+    assert result is not None, "Forced rescan should have picked up the new file."
+
+
+def test_without_size_prefilter(setup_environment):
+    """
+    Test that a run with size_prefilter=False finds the same duplicates as
+    the default prefiltered pipeline.
+    """
+    files_to_create = [
+        (base_dir + '/dir1/file1.txt', '11111'),
+        (base_dir + '/dir2/file1.txt', '11111'),
+        (base_dir + '/dir3/file2.txt', '22222'),
+    ]
+
+    setup_test_data(files_to_create)
+
+    main(base_dir, skip_existing=False, num_threads=2, size_prefilter=False)
+
+    duplicates = list_duplicates_excluding_original(
+        preferred_source_directories=[str(Path(base_dir + '/dir1').resolve())]
+    )
+
+    expected_duplicates = [
+        str(Path(base_dir + '/dir2/file1.txt').resolve())
+    ]
+
+    assert all(file in duplicates for file in expected_duplicates), "Expected duplicates not found."
+    assert len(duplicates) == len(expected_duplicates), "Unexpected duplicates found."